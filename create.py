@@ -2,26 +2,72 @@ from flask import Flask, request, Response, abort
 from markupsafe import Markup, escape
 from datetime import datetime, timezone
 from pathlib import Path
+import atexit
+import concurrent.futures
+import contextlib
+import functools
+import gzip
+import hashlib
 import io
+import itertools
 import json
 import os
 import re
+import shutil
 import sys
 import subprocess
 import tarfile
 import tempfile
+import threading
 import zipfile
 import libscowl
 
 # test with: flask --app create run -p 5000
 # http://127.0.0.1:5000/create
+#
+# in production run several workers, for example:
+#   gunicorn -w $(nproc) -k gthread --threads 4 create:app
+# the dictionary builds spend their time in subprocesses, which release the
+# GIL, so threads help; use -k sync if the load is mostly zip/tar.gz
+# wordlists (CPU bound).  The database is opened lazily per thread, so
+# --preload is safe and shares the import-time setup between workers.
+# Each worker runs at most WL_BUILD_WORKERS (default 2) speller builds at
+# once, so pick -w with that in mind.
 
 app = Flask(__name__)
 
 with open('style.css') as f:
     INLINE_STYLE = f'<style>\n{f.read()}</style>'
 
-DB_PATH = 'scowl.db'
+# Paths are made absolute up front since make_libreoffice_ext temporarily
+# changes the working directory of the whole process, including threads
+# serving other requests.
+SCOWL_DIR = os.path.abspath('scowl')
+DB_PATH = os.path.abspath('scowl.db')
+CHDIR_LOCK = threading.Lock()
+
+# Built hunspell and aspell dictionaries are cached here, least recently
+# used first out once the total size goes over CACHE_MAX_BYTES.
+CACHE_DIR = os.path.abspath(os.environ.get('WL_CACHE_DIR', 'cache'))
+CACHE_MAX_BYTES = 1 << 30
+CACHE_TMP_PREFIX = '.tmp-'
+
+_db_local = threading.local()
+
+def get_db():
+    # sqlite connections can't be shared between threads, so keep one per
+    # thread rather than opening a new one for every request.  This pays off
+    # under gunicorn, whose threads live on; the flask dev server starts a
+    # new thread for each request and so still opens one per request.
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = libscowl.openDB(DB_PATH)
+        # Reading the database through mmap uses the OS page cache directly
+        # instead of copying pages into each connection's own cache, which
+        # stays at the default size.
+        conn.execute('PRAGMA mmap_size = 268435456')
+        _db_local.conn = conn
+    return conn
 
 SPELLING_MAP = {'US': 'A', 'GBs': 'B', 'GBz': 'Z', 'CA': 'C', 'AU': 'D'}
 
@@ -47,6 +93,7 @@ SIZES = {
     80: '80 (huge)',
     85: '85 (huge+)',
 }
+SIZES_KEYS = tuple(sorted(SIZES))
 
 SPELLINGS = {
     'US':  'American',
@@ -70,6 +117,7 @@ VARIANT_LEVELS = {
     8: '8 (archaic)',
     9: '9 (invalid)',
 }
+VARIANT_LEVELS_KEYS = tuple(sorted(VARIANT_LEVELS))
 
 DIACRITICS = {
     'strip': 'Strip (café becomes cafe)',
@@ -77,24 +125,66 @@ DIACRITICS = {
     'both':  'Include Both (cafe & café)',
 }
 DIACRITIC_ORDER = ['strip', 'keep', 'both']
+DIACRITIC_KEYS = frozenset(DIACRITIC_ORDER)
+
+ENCODINGS = frozenset(('utf-8', 'iso-8859-1'))
+FORMATS = frozenset(('inline', 'tar.gz', 'zip'))
+DOWNLOADS = frozenset(('wordlist', 'hunspell', 'aspell', 'libreoffice', 'firefox'))
 
 SPECIALS = {
     'hacker':         'Hacker (for example grepped)',
     'roman-numerals': 'Roman Numerals',
 }
+SPECIALS_KEYS = tuple(SPECIALS)
+
+class DeaccentTable(dict):
+    # str.translate table that asks libscowl.deaccent about each character
+    # the first time it is seen, so any character it strips is covered;
+    # this relies on deaccent treating each character on its own, as a
+    # character map or a strip of combining marks does
+    def __missing__(self, c):
+        self[c] = result = libscowl.deaccent(chr(c))
+        return result
+
+DEACCENT_TABLE = DeaccentTable()
+
+def deaccent(word):
+    return word if word.isascii() else word.translate(DEACCENT_TABLE)
+
+# Request parameters as (name, type, allowed values, default, error).  A
+# default of None means the parameter is left out of parms when missing.
+PARMS_SCHEMA = [
+    ('max_size',      int,  range(0, 100),             60,      'max_size must be 0-99'),
+    ('spelling',      list, SPELLING_MAP,              ['US'],  'Invalid spelling: {}'),
+    ('variant_level', int,  range(0, 10),              None,    'variant_level must be 0-9'),
+    ('diacritic',     str,  DIACRITIC_KEYS,            'strip', 'Invalid diacritic option'),
+    ('special',       list, SPECIALS,                  [],      'Invalid special: {}'),
+]
+
+WORDLIST_SCHEMA = [
+    ('encoding', str, ENCODINGS, 'utf-8',  'Invalid encoding'),
+    ('format',   str, FORMATS,   'inline', 'Invalid format'),
+]
+
+# Sections of the Copyright file start with a "=== <key>" line (not the
+# first line of the file) and run up to the next one; everything before the
+# first section is the base notice.
+COPYRIGHT_SECTION_RE = re.compile(r'\n===([^\n]*)(.*?)(?=\n===|\Z)', re.S)
 
 with open('scowl/Copyright') as _f:
-    _copyright_parts = _f.read().rstrip('\n').split('\n===')
-    COPYRIGHT_BASE = _copyright_parts[0].strip('\n')
+    _copyright = _f.read()
+    _first_section = COPYRIGHT_SECTION_RE.search(_copyright)
+    COPYRIGHT_BASE = _copyright[:_first_section.start() if _first_section else None].strip('\n')
     COPYRIGHT_SECTIONS = {}
-    for _part in _copyright_parts[1:]:
-        _first_line, _, _body = _part.partition('\n')
-        _key = _first_line.strip()
+    for _key, _body in COPYRIGHT_SECTION_RE.findall(_copyright):
+        _key = _key.strip()
         if _key:
             COPYRIGHT_SECTIONS[_key] = _body.strip('\n')
 
 with open('scowl/README.md') as _f:
     README_SCOWL = _f.read()
+README_SCOWL_UTF8 = README_SCOWL.encode('utf-8')
+README_SCOWL_CRLF = README_SCOWL_UTF8.replace(b'\n', b'\r\n')
 
 GIT_VER = subprocess.run(
     ['git', 'log', '--pretty=format:%cd [%h]', '-n', '1'],
@@ -106,16 +196,25 @@ GIT_HASH = subprocess.run(
     cwd='scowl', stdout=subprocess.PIPE, text=True, check=True,
 ).stdout.strip()
 
+HEADER_BOILERPLATE = '\n\n'.join(['https://wordlist.aspell.net',
+                                   f"Using Git Commit From: {GIT_VER}",
+                                   COPYRIGHT_BASE])
+
+def freeze_parms(parms):
+    return tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(parms.items()))
+
 def build_header(parms):
+    return build_frozen_header(freeze_parms(parms))
+
+@functools.lru_cache(maxsize=128)
+def build_frozen_header(frozen_parms):
+    parms = dict(frozen_parms)
     parms_block = (
         "Custom wordlist generated from https://app.aspell.net/create using\n"
         "the English Speller Database (ESDB) with parameters:\n"
         + dump_parms(parms)
     ).rstrip('\n')
-    parts = [parms_block,
-             'https://wordlist.aspell.net',
-             f"Using Git Commit From: {GIT_VER}",
-             COPYRIGHT_BASE]
+    parts = [parms_block, HEADER_BOILERPLATE]
     if 'AU' in parms['spelling']:
         parts.append(COPYRIGHT_SECTIONS['AU'])
     if parms['max_size'] > 80:
@@ -146,36 +245,214 @@ def locale_name(spellings_raw):
         return 'en-AU'
     raise ValueError('unknown spelling')
 
+def compute_sorted_words(max_size, lc_spellings, variant_level, special, diacritic):
+    # the arguments are the validated parms in hashable form, with the
+    # spellings and specials sorted so equivalent requests share a key
+    categories = libscowl.Include(*special)
+    words = libscowl.getWords(get_db(), size=max_size, spellings=list(lc_spellings),
+                              variantLevel=variant_level, categories=categories,
+                              deaccent=False)
+
+    # Diacritic processing, deduplicating in the same pass
+    if diacritic == 'strip':
+        unique = {deaccent(w) for w in words}
+    else:
+        unique = set(words)
+        if diacritic == 'both':
+            # only words with accents gain a new form
+            unique.update([deaccent(w) for w in unique if not w.isascii()])
+
+    return tuple(sorted(unique))
+
+# Only the presets' word lists are kept in memory.  A custom list can take
+# tens of MB, every worker has its own copy, and any client can ask for new
+# ones, so those are computed per request.
+cached_preset_words = functools.lru_cache(maxsize=None)(compute_sorted_words)
+
+def preset_parms(preset):
+    # the form has every special list checked by default
+    return dict(preset, special=list(SPECIALS_KEYS))
+
+def words_key(parms):
+    # Map to libscowl args
+    lc_spellings = tuple(sorted({SPELLING_MAP[s] for s in parms['spelling']}))
+    return (parms['max_size'], lc_spellings, parms['variant_level'],
+            tuple(sorted(set(parms['special']))), parms['diacritic'])
+
+PRESET_WORDS_KEYS = frozenset(words_key(preset_parms(p)) for p in PRESETS.values())
+
+def words_for_parms(parms):
+    key = words_key(parms)
+    if key in PRESET_WORDS_KEYS:
+        return cached_preset_words(*key)
+    return compute_sorted_words(*key)
+
+# The dictionaries are built by the speller scripts in a subprocess, so a
+# thread pool is enough to bound how many builds run at once.  The limit is
+# per worker process; with several workers the box runs up to
+# workers * WL_BUILD_WORKERS builds.
+BUILD_POOL = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get('WL_BUILD_WORKERS', 2)))
+
+_scratch_local = threading.local()
+_scratch_dirs = []
+
+@atexit.register
+def _remove_scratch_dirs():
+    for tmpdir in _scratch_dirs:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+@contextlib.contextmanager
+def scratch_dir():
+    # each thread reuses one scratch directory, emptied after every job
+    tmpdir = getattr(_scratch_local, 'tmpdir', None)
+    if tmpdir is None:
+        tmpdir = _scratch_local.tmpdir = tempfile.mkdtemp(prefix='wl-web-app-')
+        _scratch_dirs.append(tmpdir)
+    try:
+        yield tmpdir
+    finally:
+        for entry in os.scandir(tmpdir):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+
+def run_speller_script(script, args, tmpdir, words):
+    env = os.environ.copy()
+    env['SCOWL'] = SCOWL_DIR
+    env.pop('SCOWL_VERSION', None)
+
+    # The scripts read ISO-8859-1, so encode the words to that here.  They
+    # are passed in the sorted order compute_sorted_words returns for all
+    # downloads, so there is no separate sort to skip here.
+    data = ('\n'.join(words) + '\n').encode('iso-8859-1')
+    try:
+        subprocess.run(
+            [os.path.join(SCOWL_DIR, 'speller', script), *args],
+            input=data,
+            cwd=tmpdir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        # callers write stderr out as text
+        e.stderr = e.stderr.decode('iso-8859-1')
+        raise
+
 def make_hunspell_dict(tmpdir, name, parms_str, words):
     parms_path = os.path.join(tmpdir, 'parms.txt')
     with open(parms_path, 'w') as f:
         f.write('With Parameters:\n')
         f.write(parms_str)
 
-    env = os.environ.copy()
-    env['SCOWL'] = os.path.abspath('scowl')
-    env.pop('SCOWL_VERSION', None)
-
-    result = subprocess.run(
-        [env['SCOWL'] + '/speller/make-hunspell-dict', '-one', name, 'parms.txt'],
-        input='\n'.join(words) + '\n',
-        encoding='iso-8859-1',
-        cwd=tmpdir,
-        env=env,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.PIPE,
-        check=True,
-    )
+    run_speller_script('make-hunspell-dict', ['-one', name, 'parms.txt'], tmpdir, words)
 
 
 def make_hunspell_zip(name, parms_str, words):
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with scratch_dir() as tmpdir:
         make_hunspell_dict(tmpdir, name, parms_str, words)
 
         zip_path = os.path.join(tmpdir, f'hunspell-{name}.zip')
         with open(zip_path, 'rb') as f:
             return f.read()
 
+def cache_path(key, words):
+    h = hashlib.sha256()
+    for part in (GIT_VER, *key):
+        h.update(part.encode('utf-8') + b'\x00')
+    for chunk in word_chunks(words, '\n', 'utf-8'):
+        h.update(chunk)
+    return os.path.join(CACHE_DIR, f'{key[0]}-{h.hexdigest()[:16]}')
+
+
+def trim_cache():
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.startswith(CACHE_TMP_PREFIX):
+            # still being written by some worker
+            continue
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    # least recently used first
+    for _, size, path in sorted(entries):
+        if total <= CACHE_MAX_BYTES:
+            break
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        total -= size
+
+
+def cached_build(key, words, build):
+    # the output of the speller scripts only depends on the key and the
+    # words, so keep it on disk and reuse it for identical requests
+    path = cache_path(key, words)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        # missing, or not readable by this user: treat as a miss
+        pass
+    else:
+        # mark as recently used; it may have been evicted since the read
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        return data
+
+    data = build()
+    try:
+        store_cached(path, data)
+    except OSError as e:
+        # failing to cache only costs the next identical request a rebuild
+        sys.stderr.write(f'could not cache {path}: {e}\n')
+    return data
+
+
+def store_cached(path, data):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix=CACHE_TMP_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp makes the file 0600; the service has to be able to read
+        # what update.sh's warm-cache run wrote
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+    trim_cache()
+
+
+def cached_hunspell_zip(name, parms_str, words):
+    return cached_build(('hunspell', name, parms_str), words,
+                        lambda: BUILD_POOL.submit(make_hunspell_zip, name, parms_str, words).result())
+
+
+def cached_aspell_dict(parms_str, words):
+    return cached_build(('aspell', parms_str), words,
+                        lambda: BUILD_POOL.submit(make_aspell_dict, parms_str, words).result())
+
+
+@app.cli.command('warm-cache')
+def warm_cache():
+    """Build the hunspell and aspell dictionaries for every preset."""
+    for defaults, preset in PRESETS.items():
+        parms = preset_parms(preset)
+        words = words_for_parms(parms)
+        parms_str = dump_parms(parms)
+        print(f'{defaults}: hunspell')
+        cached_hunspell_zip(dict_name(parms['spelling']), parms_str, words)
+        print(f'{defaults}: aspell')
+        cached_aspell_dict(parms_str, words)
+
+
 def extension_version(now):
     year = now.year
     dayinyear = now.timetuple().tm_yday
@@ -184,8 +461,6 @@ def extension_version(now):
 
 
 def make_libreoffice_ext(name, locale, parms, words):
-    import make_libreoffice as lo
-
     now = datetime.now(timezone.utc)
     date = now.strftime('%Y-%m-%d %H:%M:%S UTC')
 
@@ -197,28 +472,35 @@ def make_libreoffice_ext(name, locale, parms, words):
         'descr': Path('descr.txt'),
     }
     version = extension_version(now)
-    
-    speller_dir = os.path.abspath('scowl/speller')
 
-    with tempfile.TemporaryDirectory() as tmpdir:
+    speller_dir = os.path.join(SCOWL_DIR, 'speller')
+
+    with scratch_dir() as tmpdir:
         make_hunspell_dict(tmpdir, name, dump_parms(parms), words)
         os.symlink(
             os.path.join(speller_dir, 'libreoffice'),
             os.path.join(tmpdir, 'libreoffice'),
         )
-        orig_wd = os.getcwd()
-        try:
-            os.chdir(tmpdir)
-            with open('descr.txt', 'w') as f:
-                f.write(f"Custom {locale} speller dictionary generated from "
-                        f"https://app.aspell.net/create on {date}, "
-                        f"using the English Speller Database (ESDB, git rev {GIT_HASH}) with parameters:\n")
-                f.write(dump_parms(parms).rstrip('\n'))
-            ext_name = lo.mk_dist(config, version)
-            with open(ext_name, 'rb') as f:
-                return f.read(), ext_name
-        finally:
-            os.chdir(orig_wd)
+        # mk_dist works relative to the current directory.  That is shared
+        # by all threads, so only one build may change it at a time, and
+        # code elsewhere must not depend on it.  The import is done here,
+        # before the chdir, because it finds make_libreoffice.py through
+        # the current directory on sys.path.
+        with CHDIR_LOCK:
+            import make_libreoffice as lo
+            orig_wd = os.getcwd()
+            try:
+                os.chdir(tmpdir)
+                with open('descr.txt', 'w') as f:
+                    f.write(f"Custom {locale} speller dictionary generated from "
+                            f"https://app.aspell.net/create on {date}, "
+                            f"using the English Speller Database (ESDB, git rev {GIT_HASH}) with parameters:\n")
+                    f.write(dump_parms(parms).rstrip('\n'))
+                ext_name = lo.mk_dist(config, version)
+                with open(ext_name, 'rb') as f:
+                    return f.read(), ext_name
+            finally:
+                os.chdir(orig_wd)
 
 
 def make_firefox_ext(name, locale, parms, words):
@@ -242,7 +524,7 @@ def make_firefox_ext(name, locale, parms, words):
         "dictionaries": {locale: f"dictionaries/{name}.dic"},
     }
 
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with scratch_dir() as tmpdir:
         make_hunspell_dict(tmpdir, name, dump_parms(parms), words)
 
         buf = io.BytesIO()
@@ -296,25 +578,12 @@ def dump_parms(parms):
 
 
 def make_aspell_dict(parms_str, words):
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with scratch_dir() as tmpdir:
         parms_path = os.path.join(tmpdir, 'parms.txt')
         with open(parms_path, 'w') as f:
             f.write(parms_str)
 
-        env = os.environ.copy()
-        env['SCOWL'] = os.path.abspath('scowl')
-        env.pop('SCOWL_VERSION', None)
-
-        subprocess.run(
-            [env['SCOWL'] + '/speller/make-aspell-custom', GIT_VER, 'parms.txt'],
-            input='\n'.join(words) + '\n',
-            encoding='iso-8859-1',
-            cwd=tmpdir,
-            env=env,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            check=True,
-        )
+        run_speller_script('make-aspell-custom', [GIT_VER, 'parms.txt'], tmpdir, words)
 
         out_path = os.path.join(tmpdir, 'aspell6-en-custom.tar.bz2')
         with open(out_path, 'rb') as f:
@@ -327,6 +596,71 @@ def tar_add_bytes(tf, name, data):
     tf.addfile(info, io.BytesIO(data))
 
 
+# word lists compress well even at the lowest level, which is several
+# times faster than zlib's default
+WORDLIST_COMPRESSLEVEL = 1
+
+
+class ChunkWriter:
+    # write-only file object which collects archive output so it can be
+    # handed to the client a piece at a time
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def word_chunks(words, eol, charset, size=4096):
+    if not words:
+        # match eol.join(words) + eol
+        yield eol.encode(charset)
+    for i in range(0, len(words), size):
+        yield (eol.join(words[i:i + size]) + eol).encode(charset)
+
+
+def check_encodable(words, charset):
+    # streamed words are only encoded after the response has started, when
+    # an error can no longer be reported, so check them up front
+    if charset == 'ISO-8859-1' and any(not w.isascii() and max(w) > '\xff' for w in words):
+        abort(400, 'Word list contains words that can not be encoded as ISO-8859-1')
+
+
+def stream_tar_gz(entries):
+    out = ChunkWriter()
+    # tarfile's own 'w|gz' mode doesn't take a compression level before
+    # Python 3.12, so do the gzip layer separately
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=WORDLIST_COMPRESSLEVEL) as gz, \
+         tarfile.open(fileobj=gz, mode='w|') as tf:
+        for name, data in entries:
+            tar_add_bytes(tf, name, data)
+            yield out.drain()
+    yield out.drain()
+
+
+def stream_zip(entries):
+    # entries are (name, chunks) pairs so large members can be written
+    # without first joining them into one buffer
+    out = ChunkWriter()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED,
+                         compresslevel=WORDLIST_COMPRESSLEVEL) as zf:
+        for name, chunks in entries:
+            with zf.open(name, 'w') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield out.drain()
+    yield out.drain()
+
+
 def make_option_list(name, default, keys, values):
     parts = [f'<select name="{escape(name)}">']
     for k in keys:
@@ -349,18 +683,20 @@ def make_check_list(name, defaults, keys, values):
     return Markup(''.join(parts))
 
 
+DICTS_HTML = Markup(' \n'.join(
+    f'<a href="?defaults={escape(d)}">{escape(d)}</a>' for d in PRESETS
+))
+
+
 def render_form(defaults):
     preset = PRESETS[defaults]
-    dicts_html = ' \n'.join(
-        f'<a href="?defaults={escape(d)}">{escape(d)}</a>' for d in PRESETS
-    )
 
-    sizes_html = make_option_list('max_size', preset['max_size'], sorted(SIZES), SIZES)
+    sizes_html = make_option_list('max_size', preset['max_size'], SIZES_KEYS, SIZES)
     spellings_html = make_check_list('spelling', preset['spelling'], SPELLING_ORDER, SPELLINGS)
-    variant_html = make_option_list('variant_level', preset['variant_level'], sorted(VARIANT_LEVELS), VARIANT_LEVELS)
+    variant_html = make_option_list('variant_level', preset['variant_level'], VARIANT_LEVELS_KEYS, VARIANT_LEVELS)
     accents_html = make_option_list('diacritic', preset['diacritic'], DIACRITIC_ORDER, DIACRITICS)
-    special_defaults = preset.get('special', list(SPECIALS.keys()))
-    special_html = make_check_list('special', special_defaults, list(SPECIALS.keys()), SPECIALS)
+    special_defaults = preset.get('special', SPECIALS_KEYS)
+    special_html = make_check_list('special', special_defaults, SPECIALS_KEYS, SPECIALS)
 
     return f'''<html>
 <head>
@@ -376,7 +712,7 @@ dictionaries from the
 <p>
 Using defaults for <b>{escape(defaults)}</b> dictionary.
 <p>
-Reload with defaults from: {dicts_html} dictionary.
+Reload with defaults from: {DICTS_HTML} dictionary.
 (<a href="https://wordlist.aspell.net/hunspell-readme/" target="_blank">more info</a>)
 </p>
 <form>
@@ -425,6 +761,50 @@ install even though it is unsigned.
 
 # Custom Locale String: <input type="text" size=20 name="locale"></input><br>
 
+# the form only depends on the preset, so render each one up front
+FORMS = {d: render_form(d).encode('utf-8') for d in PRESETS}
+
+
+def parse_int(name, value):
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, f'{name} must be an integer')
+
+
+def parse_parms(args, schema):
+    parms = {}
+    for name, kind, allowed, default, error in schema:
+        if kind is list:
+            value = args.getlist(name) or list(default)
+            for v in value:
+                if v not in allowed:
+                    abort(400, error.format(v))
+        else:
+            value = args.get(name)
+            if value is None:
+                if default is None:
+                    continue
+                value = default
+            elif kind is int:
+                value = parse_int(name, value)
+            if value not in allowed:
+                abort(400, error)
+        parms[name] = value
+    return parms
+
+
+def download_response(body, content_type, filename=None):
+    # body is either the complete bytes or a generator of bytes chunks;
+    # neither needs any re-encoding by werkzeug
+    headers = {}
+    if filename:
+        headers['Content-Disposition'] = f'attachment; filename={filename}'
+    if isinstance(body, bytes):
+        headers['Content-Length'] = str(len(body))
+    return Response(body, content_type=content_type, headers=headers,
+                    direct_passthrough=True)
+
 @app.route('/create')
 def create():
     download = request.args.get('download')
@@ -433,71 +813,29 @@ def create():
         defaults = request.args.get('defaults', 'en_US')
         if defaults not in PRESETS:
             abort(400, 'Invalid defaults preset')
-        return Response(render_form(defaults), content_type='text/html; charset=UTF-8')
+        return Response(FORMS[defaults], content_type='text/html; charset=UTF-8',
+                        direct_passthrough=True)
 
-    if download not in ('wordlist', 'hunspell', 'aspell', 'libreoffice', 'firefox'):
+    if download not in DOWNLOADS:
         abort(400, 'Invalid download type')
 
     # Parse and validate shared parms
-    parms = {}
-
-    try:
-        parms['max_size'] = int(request.args.get('max_size', 60))
-    except ValueError:
-        abort(400, 'max_size must be an integer')
-    if parms['max_size'] < 0 or parms['max_size'] > 99:
-        abort(400, 'max_size must be 0-99')
-
-    parms['spelling'] = request.args.getlist('spelling') or ['US']
-    for s in parms['spelling']:
-        if s not in SPELLING_MAP:
-            abort(400, f'Invalid spelling: {s}')
-
-    # Handle both legacy max_variant and new variant_level parameters
-    if 'variant_level' in request.args:
-        try:
-            parms['variant_level'] = int(request.args.get('variant_level'))
-        except ValueError:
-            abort(400, 'variant_level must be an integer')
-        if parms['variant_level'] < 0 or parms['variant_level'] > 9:
-            abort(400, 'variant_level must be 0-9')
-    elif 'max_variant' in request.args:
-        # Backwards compatibility: map old max_variant (0-3) to new variant_level
-        try:
-            legacy_variant = int(request.args.get('max_variant'))
-        except ValueError:
-            abort(400, 'max_variant must be an integer')
-        if legacy_variant not in LEGACY_VARIANT_MAP:
-            abort(400, 'max_variant must be 0-3')
-        parms['variant_level'] = LEGACY_VARIANT_MAP[legacy_variant]
-    else:
-        # Default to level 1 (default/include)
-        parms['variant_level'] = 1
-
-    parms['diacritic'] = request.args.get('diacritic', 'strip')
-    if parms['diacritic'] not in ('strip', 'keep', 'both'):
-        abort(400, 'Invalid diacritic option')
-
-    parms['special'] = request.args.getlist('special')
-    for s in parms['special']:
-        if s not in SPECIALS:
-            abort(400, f'Invalid special: {s}')
-
-    # Map to libscowl args
-    lc_spellings = [SPELLING_MAP[s] for s in parms['spelling']]
-    categories = libscowl.Include(*parms['special'])
+    parms = parse_parms(request.args, PARMS_SCHEMA)
+
+    # Fall back to the legacy max_variant parameter if variant_level isn't given
+    if 'variant_level' not in parms:
+        if 'max_variant' in request.args:
+            # Backwards compatibility: map old max_variant (0-3) to new variant_level
+            legacy_variant = parse_int('max_variant', request.args['max_variant'])
+            if legacy_variant not in LEGACY_VARIANT_MAP:
+                abort(400, 'max_variant must be 0-3')
+            parms['variant_level'] = LEGACY_VARIANT_MAP[legacy_variant]
+        else:
+            # Default to level 1 (default/include)
+            parms['variant_level'] = 1
 
     # Generate wordlist
-    conn = libscowl.openDB(DB_PATH)
-    words = set(libscowl.getWords(conn, size=parms['max_size'], spellings=lc_spellings,
-                                  variantLevel=parms['variant_level'], categories=categories,
-                                  deaccent=False))
-
-    # Diacritic processing
-    if parms['diacritic'] == 'strip':
-        words = {libscowl.deaccent(w) for w in words}
-    elif parms['diacritic'] == 'both':
-        words |= {libscowl.deaccent(w) for w in words}
+    sorted_words = words_for_parms(parms)
 
     # locale = request.args.get('locale', '').strip()
     # if locale:
@@ -506,92 +844,74 @@ def create():
     # else:
     locale = locale_name(parms['spelling'])
 
-    sorted_words = sorted(words)
-
     if download == 'hunspell':
         name = dict_name(parms['spelling'])
         parms_str = dump_parms(parms)
         try:
-            zip_bytes = make_hunspell_zip(name, parms_str, sorted_words)
+            zip_bytes = cached_hunspell_zip(name, parms_str, sorted_words)
         except subprocess.CalledProcessError as e:
             sys.stderr.write(e.stderr)
             raise
         filename = f'hunspell-{name}.zip'
-        return Response(zip_bytes,
-                        content_type='application/zip',
-                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+        return download_response(zip_bytes, 'application/zip', filename)
 
     if download == 'libreoffice':
         name = dict_name(parms['spelling'])
         try:
-            (ext_bytes, filename) = make_libreoffice_ext(name, locale, parms, sorted_words)
+            (ext_bytes, filename) = BUILD_POOL.submit(
+                make_libreoffice_ext, name, locale, parms, sorted_words).result()
         except subprocess.CalledProcessError as e:
             sys.stderr.write(e.stderr)
             raise
-        return Response(ext_bytes,
-                        content_type='application/octet-stream',
-                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+        return download_response(ext_bytes, 'application/octet-stream', filename)
 
     if download == 'firefox':
         name = dict_name(parms['spelling'])
         try:
-            (ext_bytes, filename) = make_firefox_ext(name, locale, parms, sorted_words)
+            (ext_bytes, filename) = BUILD_POOL.submit(
+                make_firefox_ext, name, locale, parms, sorted_words).result()
         except subprocess.CalledProcessError as e:
             sys.stderr.write(e.stderr)
             raise
-        return Response(ext_bytes,
-                        content_type='application/octet-stream',
-                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+        return download_response(ext_bytes, 'application/octet-stream', filename)
 
     if download == 'aspell':
         parms_str = dump_parms(parms)
         try:
-            tar_bytes = make_aspell_dict(parms_str, sorted_words)
+            tar_bytes = cached_aspell_dict(parms_str, sorted_words)
         except subprocess.CalledProcessError as e:
             sys.stderr.write(e.stderr)
             raise
-        return Response(tar_bytes,
-                        content_type='application/octet-stream',
-                        headers={'Content-Disposition': 'attachment; filename=aspell6-en-custom.tar.bz2'})
+        return download_response(tar_bytes, 'application/octet-stream', 'aspell6-en-custom.tar.bz2')
 
     # wordlist-specific parms
-    encoding = request.args.get('encoding', 'utf-8')
-    if encoding not in ('utf-8', 'iso-8859-1'):
-        abort(400, 'Invalid encoding')
-
-    fmt = request.args.get('format', 'inline')
-    if fmt not in ('inline', 'tar.gz', 'zip'):
-        abort(400, 'Invalid format')
+    wordlist_parms = parse_parms(request.args, WORDLIST_SCHEMA)
+    encoding = wordlist_parms['encoding']
+    fmt = wordlist_parms['format']
 
     # Build response
     charset = 'UTF-8' if encoding == 'utf-8' else 'ISO-8859-1'
     header = build_header(parms)
+    check_encodable(sorted_words, charset)
 
     if fmt == 'inline':
-        text = header + '---\n' + '\n'.join(sorted_words) + '\n'
-        encoded = text.encode(charset)
-        return Response(encoded, content_type=f'text/plain; charset={charset}')
+        body = itertools.chain([(header + '---\n').encode(charset)],
+                               word_chunks(sorted_words, '\n', charset))
+        return download_response(body, f'text/plain; charset={charset}')
 
     readme_bytes = header.encode(charset)
-    scowl_readme_bytes = README_SCOWL.encode('utf-8')
 
-    buf = io.BytesIO()
     if fmt == 'tar.gz':
+        # tar needs each member's size up front, so words.txt is encoded
+        # whole and its compressed output only drained once it is written;
+        # tar.gz downloads are not streamed a chunk at a time
         words_bytes = ('\n'.join(sorted_words) + '\n').encode(charset)
-        with tarfile.open(fileobj=buf, mode='w:gz') as tf:
-            tar_add_bytes(tf, 'SCOWL-wl/README', readme_bytes)
-            tar_add_bytes(tf, 'SCOWL-wl/words.txt', words_bytes)
-            tar_add_bytes(tf, 'SCOWL-wl/README_SCOWL.md', scowl_readme_bytes)
-        return Response(buf.getvalue(),
-                        content_type='application/octet-stream',
-                        headers={'Content-Disposition': 'attachment; filename=SCOWL-wl.tar.gz'})
+        entries = [('SCOWL-wl/README', readme_bytes),
+                   ('SCOWL-wl/words.txt', words_bytes),
+                   ('SCOWL-wl/README_SCOWL.md', README_SCOWL_UTF8)]
+        return download_response(stream_tar_gz(entries), 'application/octet-stream', 'SCOWL-wl.tar.gz')
     else:  # zip
-        words_bytes = ('\r\n'.join(sorted_words) + '\r\n').encode(charset)
-        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-            zf.writestr('README', readme_bytes.replace(b'\n', b'\r\n'))
-            zf.writestr('words.txt', words_bytes)
-            zf.writestr('README_SCOWL.md', scowl_readme_bytes.replace(b'\n', b'\r\n'))
-        return Response(buf.getvalue(),
-                        content_type='application/zip',
-                        headers={'Content-Disposition': 'attachment; filename=SCOWL-wl.zip'})
-
+        entries = [('README', [readme_bytes.replace(b'\n', b'\r\n')]),
+                   ('words.txt', word_chunks(sorted_words, '\r\n', charset)),
+                   ('README_SCOWL.md', [README_SCOWL_CRLF])]
+        return download_response(stream_zip(entries), 'application/zip', 'SCOWL-wl.zip')
@@ -4,6 +4,9 @@
 
 set -e
 
+# interpreter of the web app's virtualenv
+PYTHON=${PYTHON:-/opt/wl-web-app/venv/bin/python3}
+
 echo "*** updating"
 
 cd /opt/wl-web-app
@@ -19,6 +22,16 @@ git clean -q -f -x -d
 git fetch origin v2
 git merge --ff-only origin/v2
 make scowl.db
+cd ..
+# build the preset dictionaries into the new tree's cache before it goes
+# live, as the service's user so it can read and evict them; if this fails
+# the presets are just built on first download
+SVC_USER=$(systemctl show -p User --value wl-web-app-create)
+SVC_USER=${SVC_USER:-root}
+mkdir -p cache
+chown "$SVC_USER" cache
+runuser -u "$SVC_USER" -- "$PYTHON" -m flask --app create warm-cache \
+  || echo "*** warning: warming the dictionary cache failed"
 
 echo "*** copying into place and restarting web-app(s)"
 